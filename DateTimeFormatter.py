@@ -1,10 +1,8 @@
 import logging
 from datetime import datetime
 
-import iso8601
-import rfc3339
-# pip install python-dateutil
-from dateutil import tz
+# iso8601, rfc3339 and dateutil (pip install python-dateutil) are imported where they're used
+# so importing this module stays cheap
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +22,7 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._global_format_12)
         except (TypeError, ValueError):
+            import iso8601
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._global_format_12)
 
@@ -33,6 +32,7 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._global_format_24)
         except (TypeError, ValueError):
+            import iso8601
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._global_format_24)
 
@@ -42,6 +42,7 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._usa_format_12)
         except (TypeError, ValueError):
+            import iso8601
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._usa_format_12)
 
@@ -51,16 +52,19 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._usa_format_24)
         except (TypeError, ValueError):
+            import iso8601
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._usa_format_24)
 
     @staticmethod
     def r3339(dt=None):
+        import rfc3339
         if not dt:
             return rfc3339.rfc3339(datetime.utcnow())
         try:
             return rfc3339.rfc3339(datetime.fromtimestamp(float(dt)))
         except (TypeError, ValueError):
+            import iso8601
             _i = iso8601.parse_date(str(dt))
             return rfc3339.rfc3339(_i)
 
@@ -71,6 +75,7 @@ class DateTimeFormatter:
         try:
             return datetime.isoformat(datetime.fromtimestamp(float(dt)))
         except (TypeError, ValueError):
+            import iso8601
             return iso8601.parse_date(str(dt))
 
     @staticmethod
@@ -80,6 +85,7 @@ class DateTimeFormatter:
         try:
             return float(dt)
         except (TypeError, ValueError):
+            import iso8601
             _i = iso8601.parse_date(str(dt))
             return _i.timestamp()
 
@@ -92,6 +98,7 @@ class DateTimeFormatter:
         :return: Parameter datetime adjusted to use the local timezone
         :rtype: datetime
         """
+        from dateutil import tz
         utc_dt = utc_dt.replace(tzinfo=tz.gettz("UTC"))
         return utc_dt.astimezone(tz.tzlocal())
 
@@ -104,6 +111,7 @@ class DateTimeFormatter:
         :return: Parameter datetime adjusted to use the UTC timezone
         :rtype: datetime
         """
+        from dateutil import tz
         local_dt = local_dt.replace(tzinfo=tz.tzlocal())
         return local_dt.astimezone(tz.tzlocal())
 
@@ -120,5 +128,6 @@ class DateTimeFormatter:
         :return: A datetime
         :rtype: datetime
         """
+        from dateutil import tz
         dt = dt.replace(tzinfo=tz.gettz(source_tz))
         return dt.replace(tzinfo=tz.gettz(dest_tz))
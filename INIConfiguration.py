@@ -1,7 +1,17 @@
 from Utils import Utils
+import glob
+import hashlib
 import json
 import logging
-import configparser
+import marshal
+import os
+import tempfile
+import time
+
+# configparser and concurrent.futures are imported when a file is actually parsed,
+# so loading from a snapshot doesn't pay for them
+
+SNAPSHOT_VERSION = 2
 
 utils = Utils
 
@@ -9,24 +19,49 @@ logger = logging.getLogger(__name__)
 
 
 class INIConfiguration:
-    def __init__(self, config_path, normalize=False):
+    def __init__(self, config_path, normalize=False, cached=False, check_interval=0, max_workers=8,
+                 snapshot_path=None):
         """Get or update an INI formatted configuration.
 
-        :param config_path: Path to a INI formatted file.
-        :type config_path: [Path, str]
+        :param config_path: Path to a INI formatted file, or a list of paths and globs
+            (e.g. ["base.ini", "prod.ini", "conf.d/*.ini"]) merged in order, later sources win.
+        :type config_path: [Path, str, list]
         :param normalize: Capitalized keys are lowercased and spaces in keys are replaced with '_'.
         :type normalize: bool
+        :param cached: Parse once and serve the configuration from memory until the file changes.
+        :type cached: bool
+        :param check_interval: In cached mode, minimum seconds between checks of the file's mtime.
+        :type check_interval: [int, float]
+        :param max_workers: Maximum number of files parsed concurrently.
+        :type max_workers: int
+        :param snapshot_path: Optional file for a compiled snapshot of the parsed configuration.
+            It's loaded instead of parsing when the source files' hashes match.
+        :type snapshot_path: [Path, str]
         """
         self.config = {}
-        _config_dict = {}
-        self._config_path = Utils.expand_path(config_path)
-        self.update = None
+        if isinstance(config_path, (list, tuple)):
+            self._sources = [str(Utils.expand_path(_p)) for _p in config_path]
+        else:
+            self._sources = [str(Utils.expand_path(config_path))]
+        self._config_path = Utils.expand_path(self._sources[0])
+        self._updating = False
         self.normalize = normalize
+        self.cached = cached
+        self.check_interval = check_interval
+        self.max_workers = max_workers
+        self._stat = None
+        self._last_check = 0.0
+        self._callbacks = []
+        # {path: (stat, parsed config, sha256 of the parsed bytes)} for each source file
+        self._files = {}
+        self._snapshot_path = Utils.expand_path(snapshot_path) if snapshot_path else None
+        # The source hashes in the snapshot as last loaded or written
+        self._snapshot_hashes = None
 
     def _format_keys(self, str_):
         if not self.normalize:
             return str_
-        if self.update:
+        if self._updating:
             str_ = str_.upper()
             return str_.replace("_", " ")
         str_ = str_.lower()
@@ -40,38 +75,300 @@ class INIConfiguration:
             return False
         return v
 
-    def get(self):
-        """Get and return the configuration from disk as a dict
-        :return: The configuration as a dict
-        :rtype: dict
+    @staticmethod
+    def _file_stat(path):
+        try:
+            _s = os.stat(path)
+        except OSError:
+            return None
+        return _s.st_mtime_ns, _s.st_size, _s.st_ino
+
+    def _expand_sources(self) -> list:
+        """ Return the source files in precedence order, globs are expanded and sorted """
+        _paths = []
+        for _source in self._sources:
+            if glob.has_magic(_source):
+                _paths.extend(sorted(glob.glob(_source)))
+            else:
+                _paths.append(_source)
+        return _paths
+
+    def _sources_stat(self):
+        return tuple((_p, self._file_stat(_p)) for _p in self._expand_sources())
+
+    def _is_stale(self) -> bool:
+        """ True if any source changed since it was parsed. The stat is skipped inside check_interval """
+        if self._stat is None:
+            return True
+        _now = time.monotonic()
+        if _now - self._last_check < self.check_interval:
+            return False
+        self._last_check = _now
+        return self._sources_stat() != self._stat
+
+    def on_change(self, callback):
+        """Register a callback called as callback(config) when a cached configuration is reloaded.
+        Like get(), each callback gets its own copy of the configuration.
+
+        :param callback: A callable taking the new configuration dict
+        :type callback: callable
         """
-        _config_file = None
+        self._callbacks.append(callback)
+
+    @staticmethod
+    def _file_hash(path):
+        try:
+            with open(path, "rb") as _f:
+                return hashlib.sha256(_f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def _load_snapshot(self, stats) -> bool:
+        """ Populate the per-file cache from the snapshot if it matches the sources. Returns True if it did """
+        try:
+            with open(self._snapshot_path, "rb") as _f:
+                _snapshot = marshal.load(_f)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            logger.debug(f"Not using snapshot {self._snapshot_path}: {e}")
+            return False
+        if not isinstance(_snapshot, dict) or _snapshot.get("version") != SNAPSHOT_VERSION:
+            return False
+        if _snapshot.get("normalize") != self.normalize:
+            return False
+        _hashes = _snapshot.get("hashes", {})
+        if [_p for (_p, _) in stats] != list(_hashes):
+            return False
+        for (_p, _) in stats:
+            if self._file_hash(_p) != _hashes[_p]:
+                return False
+        for (_p, _st) in stats:
+            self._files[_p] = (_st, _snapshot["files"][_p], _hashes[_p])
+        self._snapshot_hashes = _hashes
+        logger.debug(f"Loaded configuration snapshot {self._snapshot_path}")
+        return True
+
+    def _write_snapshot(self):
+        """ Write the snapshot unless it already holds exactly these sources """
+        _hashes = {_p: self._files[_p][2] for (_p, _) in self._stat}
+        if _hashes == self._snapshot_hashes:
+            return
+        _snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "normalize": self.normalize,
+            "hashes": _hashes,
+            "files": {_p: self._files[_p][1] for (_p, _) in self._stat},
+        }
+        _path = self._snapshot_path
+        try:
+            _fd, _tmp = tempfile.mkstemp(dir=_path.parent, prefix=f".{_path.name}.")
+        except OSError as e:
+            logger.warning(f"Unable to write snapshot {_path}: {e}")
+            return
+        try:
+            with os.fdopen(_fd, "wb") as _f:
+                marshal.dump(_snapshot, _f)
+            os.replace(_tmp, _path)
+            self._snapshot_hashes = _hashes
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unable to write snapshot {_path}: {e}")
+            os.unlink(_tmp)
+
+    def _parse(self, path) -> tuple:
+        """ Parse a single INI file. Returns (dict, sha256 of the bytes that were parsed) """
+        import configparser
+
         _parsed_config = configparser.ConfigParser()
+        _hash = None
         try:
-            _config_file = open(self._config_path, "r")
+            with open(path, "rb") as _config_file:
+                _bytes = _config_file.read()
+            _hash = hashlib.sha256(_bytes).hexdigest()
+            _parsed_config.read_string(_bytes.decode(), source=str(path))
         except OSError as e:
             logger.error(str(e))
             Utils.exiter(1)
-        try:
-            _parsed_config.read_file(_config_file)
         except configparser.ParsingError as e:
             logger.error(str(e))
             Utils.exiter(1)
 
+        config = {}
         _defaults = _parsed_config.defaults()
         _t = {}
-        for (_k, _v) in _defaults:
+        for (_k, _v) in _defaults.items():
             _t[self._format_keys(_k)] = self._format_values(_v)
-        self.config[self._format_keys("defaults")] = _t
+        config[self._format_keys("defaults")] = _t
 
+        # Only the keys set in the section itself, the merged defaults are applied in _merge
         for _s in _parsed_config.sections():
             _t = {}
+            _explicit = _parsed_config._sections[_s]
             for (_k, _v) in _parsed_config.items(_s):
-                _t[self._format_keys(_k)] = self._format_values(_v)
-            self.config[self._format_keys(_s)] = _t
-        logger.debug(f"Got config: {json.dumps(self.config, indent=2)}")
+                if _k in _explicit:
+                    _t[self._format_keys(_k)] = self._format_values(_v)
+            config[self._format_keys(_s)] = _t
+        return config, _hash
+
+    def get(self):
+        """Get and return the configuration from disk as a dict
+        :return: The configuration as a dict. It's a copy, changing it doesn't touch the cache.
+        :rtype: dict
+        """
+        return self._copy(self._load())
+
+    @staticmethod
+    def _copy(config) -> dict:
+        """ A copy of the configuration that callers can change without touching the cache """
+        return {_section: dict(_values) for (_section, _values) in config.items()}
+
+    def _load(self) -> dict:
+        """ Return the cached configuration, parsing whatever changed. The result must not be modified """
+        if self.cached and not self._is_stale():
+            return self.config
+        _reloaded = self._stat is not None
+        self._stat = self._sources_stat()
+        self._last_check = time.monotonic()
+        if not _reloaded and self._snapshot_path and self._load_snapshot(self._stat):
+            self.config = self._merge()
+            return self.config
+
+        # Only files that changed since they were last parsed are parsed again
+        _changed = [
+            _p for (_p, _st) in self._stat
+            if not self.cached or _p not in self._files or self._files[_p][0] != _st
+        ]
+        if len(_changed) > 1 and self.max_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(_changed))) as _executor:
+                _parsed = list(_executor.map(self._parse, _changed))
+        else:
+            _parsed = [self._parse(_p) for _p in _changed]
+        _stats = dict(self._stat)
+        for (_p, (_c, _h)) in zip(_changed, _parsed):
+            self._files[_p] = (_stats[_p], _c, _h)
+        for _p in list(self._files):
+            if _p not in _stats:
+                del self._files[_p]
+
+        self.config = self._merge()
+        if self._snapshot_path and _changed:
+            self._write_snapshot()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Got config: {json.dumps(self.config, indent=2)}")
+        if self.cached and _reloaded:
+            for _callback in self._callbacks:
+                try:
+                    _callback(self._copy(self.config))
+                except Exception as err:
+                    logger.error(f"Configuration change callback failed: {err}")
         return self.config
 
-    def update(self, update: dict):
-        # TODO
-        pass
+    def _merge(self) -> dict:
+        """ Merge the parsed sources in precedence order, then fill every section from the merged defaults """
+        config = {}
+        for (_p, _) in self._stat:
+            for (_section, _values) in self._files[_p][1].items():
+                config.setdefault(_section, {}).update(_values)
+        _defaults_name = self._format_keys("defaults")
+        _defaults = config.setdefault(_defaults_name, {})
+        for _section in config:
+            if _section != _defaults_name:
+                config[_section] = {**_defaults, **config[_section]}
+        return config
+
+    def get_value(self, section, key, default=None):
+        """Return a single value, reparsing only if the file changed.
+
+        :param section: Section name, as it appears in the returned dict
+        :type section: str
+        :param key: Key name, as it appears in the returned dict
+        :type key: str
+        :param default: Returned if the section or key doesn't exist
+        :return: The value
+        """
+        return self._load().get(section, {}).get(key, default)
+
+    def get_str(self, section, key, default=None):
+        _v = self.get_value(section, key, default)
+        return _v if _v is None else str(_v)
+
+    def get_int(self, section, key, default=None):
+        _v = self.get_value(section, key, default)
+        # "1"/"0" are coerced to booleans by _format_values
+        return _v if _v is None else int(_v)
+
+    def get_float(self, section, key, default=None):
+        _v = self.get_value(section, key, default)
+        return _v if _v is None else float(_v)
+
+    def get_bool(self, section, key, default=None):
+        _v = self.get_value(section, key, default)
+        if isinstance(_v, str):
+            return self._format_values(_v) is True
+        return _v if _v is None else bool(_v)
+
+    def update(self, update: dict, path=None):
+        """Merge `update` into an INI file and atomically write it back. Comments are not preserved.
+        `%` in values is escaped so get() reads them back unchanged. A new file is created with mode 0644.
+
+        :param update: {section: {key: value}} using the same names get() returns.
+            The "defaults" section is written to [DEFAULT].
+        :type update: dict
+        :param path: File to update, defaults to the first configuration source
+        :type path: [Path, str]
+        :return: True if the file was written
+        :rtype: bool
+        """
+        import configparser
+
+        _path = Utils.expand_path(path) if path else self._config_path
+        _parsed_config = configparser.ConfigParser(interpolation=None)
+        try:
+            with open(_path, "r") as _config_file:
+                _parsed_config.read_file(_config_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, configparser.ParsingError) as e:
+            logger.error(str(e))
+            return False
+
+        self._updating = True
+        try:
+            # Reuse the names already in the file, only new names have their normalization reversed
+            _sections = {self._updating_key(_s): _s for _s in _parsed_config.sections()}
+            for (_section, _values) in update.items():
+                if _section == "defaults":
+                    _name = configparser.DEFAULTSECT
+                else:
+                    _name = _sections.get(_section, self._format_keys(_section))
+                    if not _parsed_config.has_section(_name):
+                        _parsed_config.add_section(_name)
+                _keys = {self._updating_key(_k): _k for _k in _parsed_config[_name]}
+                for (_k, _v) in _values.items():
+                    if isinstance(_v, bool):
+                        _v = "true" if _v else "false"
+                    _parsed_config[_name][_keys.get(_k, self._format_keys(_k))] = str(_v).replace("%", "%%")
+        finally:
+            self._updating = False
+
+        try:
+            _fd, _tmp = tempfile.mkstemp(dir=_path.parent, prefix=f".{_path.name}.")
+        except OSError as e:
+            logger.error(f"Unable to write {_path}: {e}")
+            return False
+        try:
+            with os.fdopen(_fd, "w") as _f:
+                _parsed_config.write(_f)
+            os.chmod(_tmp, _path.stat().st_mode if _path.exists() else 0o644)
+            os.replace(_tmp, _path)
+        except OSError as e:
+            logger.error(f"Unable to write {_path}: {e}")
+            os.unlink(_tmp)
+            return False
+        return True
+
+    def _updating_key(self, str_):
+        """ The name get() would return for a name in the file """
+        if not self.normalize:
+            return str_
+        return str_.lower().replace(" ", "_")
@@ -1,14 +1,52 @@
 import logging
-import keyring
-import keyring.errors
+import threading
+import time
+
+# keyring and concurrent.futures are imported on first use, keyring's backend discovery is slow
 
 logger = logging.getLogger(__name__)
 
+# Seconds a secret is served from memory before going back to the keyring
+CACHE_TTL = 300
+
+# Seconds between sweeps of the whole cache for expired secrets
+PURGE_INTERVAL = 60
+
+# {(service_name, secret_name): (expires, secret)}
+_cache = {}
+_cache_lock = threading.Lock()
+_next_purge = 0.0
+
+
+def _purge_expired(now):
+    """ Drop expired secrets so they don't linger in memory, at most every PURGE_INTERVAL seconds.
+    Call with the lock held. """
+    global _next_purge
+    if now < _next_purge:
+        return
+    _next_purge = now + PURGE_INTERVAL
+    for _key in [_k for (_k, (_expires, _)) in _cache.items() if _expires <= now]:
+        del _cache[_key]
+
+
+def _cached(secret_name, service_name):
+    _now = time.monotonic()
+    _key = (service_name, secret_name)
+    with _cache_lock:
+        _purge_expired(_now)
+        _entry = _cache.get(_key)
+        if _entry and _entry[0] <= _now:
+            del _cache[_key]
+            _entry = None
+    return _entry[1] if _entry else None
+
+
+def _fetch(secret_name, service_name, ttl):
+    import keyring
+    import keyring.errors
 
-def get_secret(secret_name, service_name):
-    """ Return a secret or None if the secret does not exist."""
     try:
-        return keyring.get_password(
+        _secret = keyring.get_password(
             service_name=service_name, username=secret_name
         )
     except keyring.errors.KeyringError as err:
@@ -16,13 +54,67 @@ def get_secret(secret_name, service_name):
             f"Error getting {service_name}: {secret_name} from the keyring."
         )
         logger.error(f"ERROR: {err}")
+        return None
+    if _secret is not None and ttl > 0:
+        with _cache_lock:
+            _cache[(service_name, secret_name)] = (time.monotonic() + ttl, _secret)
+    return _secret
+
+
+def get_secret(secret_name, service_name, ttl=None):
+    """ Return a secret or None if the secret does not exist. Secrets are cached for `ttl` seconds, 0 disables. """
+    ttl = CACHE_TTL if ttl is None else ttl
+    if ttl > 0:
+        _secret = _cached(secret_name, service_name)
+        if _secret is not None:
+            return _secret
+    return _fetch(secret_name, service_name, ttl)
+
+
+def get_secrets(secret_names, service_name, ttl=None, max_workers=4) -> dict:
+    """ Return {secret_name: secret or None}. Secrets that aren't cached are fetched concurrently.
+    Use max_workers=1 for backends that can't be called from several threads. """
+    ttl = CACHE_TTL if ttl is None else ttl
+    secrets = {}
+    _missing = []
+    for _name in secret_names:
+        secrets[_name] = _cached(_name, service_name) if ttl > 0 else None
+        if secrets[_name] is None:
+            _missing.append(_name)
+    if len(_missing) > 1 and max_workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(_missing))) as _executor:
+            _fetched = _executor.map(lambda _n: _fetch(_n, service_name, ttl), _missing)
+            secrets.update(zip(_missing, _fetched))
+    else:
+        for _name in _missing:
+            secrets[_name] = _fetch(_name, service_name, ttl)
+    return secrets
+
+
+def invalidate(service_name=None, secret_name=None):
+    """ Drop cached secrets. With no arguments the whole cache is cleared. """
+    with _cache_lock:
+        for _key in list(_cache):
+            if service_name is not None and _key[0] != service_name:
+                continue
+            if secret_name is not None and _key[1] != secret_name:
+                continue
+            del _cache[_key]
 
 
 def set_secret(service_name, secret_name, secret) -> bool:
+    import keyring
+    import keyring.errors
+
+    invalidate(service_name, secret_name)
     try:
         keyring.set_password(
             service_name=service_name, username=secret_name, password=secret
         )
+        # Again, a concurrent get_secret may have cached the old value while the keyring was written
+        invalidate(service_name, secret_name)
         return True
     except keyring.errors.PasswordSetError as err:
         logger.error(
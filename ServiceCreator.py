@@ -1,26 +1,105 @@
 # Service creators for SystemD, macOS, Windows
+import hashlib
 import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
 from pathlib import Path
 from Utils import Utils
-from SubProcessor import SubProcessor
+from SubProcessor import CommandResult, SubProcessor
 
 logger = logging.getLogger(__name__)
 
 utils = Utils
 subprocessor = SubProcessor()
 
+SYSTEMD_TEMPLATE = (
+    "[Unit]\n"
+    "Description={description}\n"
+    "Documentation={documentation}\n"
+    "StartLimitIntervalSec=0\n"
+    "\n"
+    "[Service]\n"
+    "Type={service_type}\n"
+    "Restart={restart}\n"
+    "RestartSec={restart_sec}\n"
+    "User={user}\n"
+    "ExecStart={executable_path}\n"
+    "{limits}"
+    "\n"
+    "[Install]\n"
+    "WantedBy={wanted_by}"
+)
+
+LAUNCHD_PATH = (
+    "/usr/local/opt/icu4c/sbin:/usr/local/opt/icu4c/bin:/usr/local/sbin:/usr/local/bin:/usr/bin:/bin"
+    ":/usr/sbin:/sbin:/Users/admin/go/bin"
+)
+
+
+def _hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _write_if_changed(path: Path, content: str, mode=None) -> bool:
+    """Atomically write `content` to `path` unless the installed file already has the same hash.
+
+    :param path: File to write
+    :type path: Path
+    :param content: New file contents
+    :type content: str
+    :param mode: Optional permissions for the file
+    :type mode: int
+    :return: True if the file was written
+    :rtype: bool
+    """
+    _content = content.encode()
+    try:
+        if _hash(path.read_bytes()) == _hash(_content):
+            logger.debug(f"{path} is unchanged.")
+            return False
+    except OSError:
+        pass
+    logger.debug(f"Writing {path}")
+    _fd, _tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(_fd, "wb") as f:
+            f.write(_content)
+        if mode is not None:
+            os.chmod(_tmp, mode)
+        os.replace(_tmp, path)
+    except OSError:
+        Path(_tmp).unlink(missing_ok=True)
+        raise
+    return True
+
 
 class SystemD(object):
-    def __init__(self, service_mode, service_name, description, executable_path, wanted_by, documentation=""):
+    def __init__(self, service_mode, service_name, description, executable_path, wanted_by, documentation="",
+                 service_dir="/etc/systemd/system/", **kwargs):
+        """A systemd service.
+
+        :param kwargs: Unit file directives; user, restart, restart_sec, service_type,
+            limits (dict of resource limit directives e.g. {"LimitNOFILE": 65536, "MemoryMax": "1G"})
+            and template (defaults to SYSTEMD_TEMPLATE)
+        """
         self.service_mode = service_mode
         self.service_name = service_name
         self.description = description
         self.documentation = documentation
         self.executable_path = str(executable_path)
         self.wanted_by = wanted_by
-        self.service_path = Path("/etc/systemd/system/")
+        self.service_path = Path(service_dir)
         self.service_path = self.service_path.joinpath(self.service_name)
         self.reload_daemon = "systemctl daemon-reload"
+        self.user = kwargs.get("user", "root")
+        self.restart = kwargs.get("restart", "always")
+        self.restart_sec = kwargs.get("restart_sec", 2)
+        self.service_type = kwargs.get("service_type", "simple")
+        self.limits = kwargs.get("limits", {})
+        self.template = kwargs.get("template", SYSTEMD_TEMPLATE)
 
     def disable(self):
         """ Disable the service if it exists """
@@ -44,52 +123,126 @@ class SystemD(object):
         lib_systemd = Path("/usr/lib/systemd/system/")
         lib_systemd = lib_systemd.joinpath(self.service_name)
         lib_systemd.unlink(missing_ok=True)
-        subprocessor.run_subprocess([self.reload_daemon, _reset_failed])
+        subprocessor.run_batch([self.reload_daemon, _reset_failed])
         logger.info("Automatic start disabled")
 
     def _check_service(self):
         """ Return true if the service is active """
         _is_active = "systemctl is-active " + self.service_name
         status = subprocessor.run_subprocess([_is_active])
-        return status == "active"
-
-    def _make_systemd_service_file(self):
-        service = (
-            f"[Unit]\n"
-            f"Description={self.description}\n"
-            f"Documentation={self.documentation}\n"
-            f"StartLimitIntervalSec=0\n"
-            f"\n"
-            f"[Service]\n"
-            f"Type=simple\n"
-            f"Restart=always\n"
-            f"RestartSec=2\n"
-            f"User=root\n"
-            f"ExecStart={self.executable_path}\n"
-            f"\n"
-            f"[Install]\n"
-            f"WantedBy={self.wanted_by}"
+        return bool(status) and status.stdout.strip() == "active"
+
+    def _render(self) -> str:
+        """ Return the contents of the unit file """
+        _limits = "".join(f"{_k}={_v}\n" for (_k, _v) in self.limits.items())
+        return self.template.format(
+            description=self.description,
+            documentation=self.documentation,
+            service_type=self.service_type,
+            restart=self.restart,
+            restart_sec=self.restart_sec,
+            user=self.user,
+            executable_path=self.executable_path,
+            limits=_limits,
+            wanted_by=self.wanted_by,
         )
-        logger.debug(f"Creating service file {self.service_path}")
+
+    def _write_if_changed(self) -> bool:
+        """ Atomically write the unit file if its contents changed. Returns True if it was written """
+        return _write_if_changed(self.service_path, self._render(), int(str(self.service_mode), 8))
+
+    @staticmethod
+    def _systemctl(*args):
+        """ Run one systemctl invocation without a shell """
+        _command = ["systemctl", *args]
+        result = CommandResult(_command, started=time.time())
+        _start = time.perf_counter()
         try:
-            with open(self.service_path, "w") as f:
-                f.write(service)
+            _completed = subprocess.run(_command, capture_output=True, text=True, timeout=120)
+            result.returncode = _completed.returncode
+            result.stdout = _completed.stdout.splitlines()
+            result.stderr = _completed.stderr.splitlines()
+        except subprocess.TimeoutExpired as err:
+            result.timed_out = True
+            result.error = err
         except OSError as err:
-            logger.error(f'Error creating service file; {self.service_path}' 
-                         f'ERROR: {str(err)}')
+            result.error = err
+        result.duration = time.perf_counter() - _start
+        return result
+
+    @staticmethod
+    def create_many(units: list) -> dict:
+        """Create or update many systemd services with a single daemon-reload.
+
+        Unit files that haven't changed are not rewritten or restarted.
+
+        :param units: SystemD instances
+        :type units: list
+        :return: {service_name: {"written": bool, "state": `systemctl is-active` output,
+            "errors": [failed steps for this unit]}}
+        :rtype: dict
+        """
+        status = {}
+        _changed = []
+        _unchanged = []
+        for _unit in units:
+            _written = False
+            try:
+                _written = _unit._write_if_changed()
+            except OSError as err:
+                logger.error(f"Error creating service file {_unit.service_path} ERROR: {str(err)}")
+                status[_unit.service_name] = {"written": False, "state": "failed", "errors": [f"write: {err}"]}
+                continue
+            status[_unit.service_name] = {"written": _written, "state": None, "errors": []}
+            (_changed if _written else _unchanged).append(_unit.service_name)
+        _names = _changed + _unchanged
+        if not _names:
+            return status
+
+        def _step(units_, *args):
+            """ Run a systemctl step and record a failure against every unit it covers """
+            _result = SystemD._systemctl(*args)
+            if not _result.ok:
+                _reason = _result.error or " ".join(_result.stderr) or f"exit code {_result.returncode}"
+                logger.error(f"systemctl {args[0]} failed: {_reason}")
+                for _name in units_:
+                    status[_name]["errors"].append(f"{args[0]}: {_reason}")
+            return _result
+
+        if _changed:
+            _step(_names, "daemon-reload")
+        _step(_names, "enable", *_names)
+        if _changed:
+            _step(_changed, "restart", *_changed)
+        if _unchanged:
+            _step(_unchanged, "start", *_unchanged)
+
+        # is-active prints one state per unit, in the order given
+        _states = SystemD._systemctl("is-active", *_names).stdout
+        for _name, _state in zip(_names, _states):
+            status[_name]["state"] = _state.strip()
+            if status[_name]["state"] == "active":
+                logger.info(f"{_name} is running.")
+            else:
+                logger.error(f"{_name} failed to start. Check `systemctl status {_name}` for details.")
+        return status
 
     def create(self) -> bool:
-        """ Create a systemd service """
-        _start = "systemctl start " + self.service_name
+        """ Create or update a systemd service. It is only restarted if the unit file changed """
         _enable = "systemctl enable " + self.service_name
-        _chmod = "chmod " + str(self.service_mode) + " " + str(self.service_path)
-        _exists = "systemctl list-unit-files | grep " + self.service_name
-        _service = subprocessor.run_subprocess([_exists])
-        if _service:
-            self.remove()
-        self._make_systemd_service_file()
-        # Activate the service
-        subprocessor.run_subprocess([_chmod, self.reload_daemon, _enable, _start])
+        try:
+            _changed = self._write_if_changed()
+        except OSError as err:
+            logger.error(f'Error creating service file; {self.service_path} ERROR: {str(err)}')
+            return False
+        if not _changed and self._check_service():
+            logger.info(f"{self.service_name} is unchanged and running.")
+            return True
+        # Activate the service, the commands share one shell
+        if _changed:
+            subprocessor.run_batch([self.reload_daemon, _enable, "systemctl restart " + self.service_name])
+        else:
+            subprocessor.run_batch([_enable, "systemctl start " + self.service_name])
         if self._check_service():
             logger.info(f"Automatic start enabled, {self.service_name} is running.")
             return True
@@ -99,86 +252,198 @@ class SystemD(object):
             return False
 
 
+class ServiceWatcher(object):
+    """Track the state of many systemd units with one `systemctl show` per poll.
+
+    Polling backs off while nothing changes and drops back to `interval` on any transition.
+    """
+
+    def __init__(self, units: list, callback=None, interval=2.0, max_interval=60.0, backoff=2.0):
+        """
+        :param units: Unit names to watch
+        :type units: list
+        :param callback: Called as callback(unit, old_state, new_state) on every transition
+        :type callback: callable
+        :param interval: Seconds between polls after a change
+        :type interval: float
+        :param max_interval: Upper bound for the poll interval while nothing changes
+        :type max_interval: float
+        :param backoff: Poll interval multiplier while nothing changes
+        :type backoff: float
+        """
+        self.units = list(units)
+        self.callback = callback
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.states = {}
+        self._current_interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _show(self) -> dict:
+        """ Return {unit: {"Id": ..., "Names": ..., "ActiveState": ...}} from a single systemctl call """
+        _result = SystemD._systemctl("show", "--property=Id,Names,ActiveState", *self.units)
+        if not _result.ok:
+            # Still use whatever was printed, one bad unit name shouldn't hide the others
+            logger.error(f"systemctl show failed: {_result.error or ' '.join(_result.stderr)}")
+        # One block per unit separated by blank lines, matched to our names by Id or any alias in Names
+        _by_name = {}
+        _block = {}
+        for _line in _result.stdout + [""]:
+            if not _line.strip():
+                for _name in [_block.get("Id")] + _block.get("Names", "").split():
+                    if _name:
+                        _by_name[_name] = _block
+                _block = {}
+                continue
+            _k, _, _v = _line.partition("=")
+            _block[_k] = _v
+        units = {}
+        for _unit in self.units:
+            # systemctl reports bare names as <name>.service
+            _properties = _by_name.get(_unit) or _by_name.get(_unit + ".service")
+            if _properties:
+                units[_unit] = _properties
+            else:
+                logger.error(f"systemctl show returned nothing for {_unit}")
+        return units
+
+    def poll(self) -> dict:
+        """Refresh the cached states and fire the callback for any transitions.
+
+        :return: The units that changed as {unit: (old_state, new_state)}
+        :rtype: dict
+        """
+        changed = {}
+        for (_unit, _properties) in self._show().items():
+            _new = _properties.get("ActiveState")
+            _old = self.states.get(_unit)
+            if _new == _old:
+                continue
+            self.states[_unit] = _new
+            changed[_unit] = (_old, _new)
+            logger.debug(f"{_unit}: {_old} -> {_new}")
+            if self.callback:
+                try:
+                    self.callback(_unit, _old, _new)
+                except Exception as err:
+                    logger.error(f"Service watcher callback failed for {_unit}: {err}")
+        if changed:
+            self._current_interval = self.interval
+        else:
+            self._current_interval = min(self._current_interval * self.backoff, self.max_interval)
+        return changed
+
+    def is_active(self, unit) -> bool:
+        """ Return the last known state of a unit without calling systemctl """
+        return self.states.get(unit) == "active"
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self._current_interval)
+
+    def start(self):
+        """ Poll in a background thread until stop() is called """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ServiceWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
 class LaunchD(object):
     """ Create a MacOS service """
 
-    def __init__(self, service_name, executable_path):
+    def __init__(self, service_name, executable_path, service_dir="/System/Library/LaunchDaemons", **kwargs):
+        """A launchd service.
+
+        :param kwargs: plist keys; program_arguments (list), environment (dict),
+            run_at_load, keep_alive and launch_only_once (bool)
+        """
         self._service_name = service_name
-        self._executable_path = executable_path
-        self._service_path = Path("/System/Library/LaunchDaemons")
-        self._service_path = Path(self._service_path.joinpath(self._service_name))
-        self._service_path = Path(self._service_path.joinpath(".plist"))
+        self._executable_path = str(executable_path)
+        self._service_path = Path(service_dir)
+        self._service_path = self._service_path.joinpath(self._service_name + ".plist")
+        self._program_arguments = kwargs.get("program_arguments", [self._executable_path, "monitor"])
+        self._environment = kwargs.get("environment", {"PATH": LAUNCHD_PATH})
+        self._run_at_load = kwargs.get("run_at_load", True)
+        self._keep_alive = kwargs.get("keep_alive", False)
+        self._launch_only_once = kwargs.get("launch_only_once", True)
 
     def _is_active(self):
         """ Return true if the service is active """
         _is_active = "launchctl list | grep " + self._service_name
         _status = subprocessor.run_subprocess([_is_active])
-        return bool(_status)
-
-    def _make_plist_file(self):
-        _plist = (
-            f'<?xml version="1.0" encoding="UTF-8"?>\n'
-            f'<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n'
-            f'<plist version="1.0">\n'
-            f"  <dict>\n"
-            f"    <key>EnvironmentVariables</key>\n"
-            f"    <dict>\n"
-            f"      <key>PATH</key>\n"
-            f"<string>/usr/local/opt/icu4c/sbin:/usr/local/opt/icu4c/bin:/usr/local/sbin:/usr/local/bin:/usr/bin:/bin"
-            f":/usr/sbin:/sbin:/Users/admin/go/bin\n "
-            f"      </string>\n"
-            f"    </dict>\n"
-            f"    <key>Label</key>\n"
-            f"      <string>{self._service_name}</string>\n"
-            f"    <key>Program</key>\n"
-            f"      <string>{self._executable_path}</string>\n"
-            f"    <key>ProgramArguments</key>\n"
-            f"      <string>monitor</string>\n"
-            f"    <key>RunAtLoad</key>\n"
-            f"      <true/>\n"
-            f"    <key>KeepAlive</key>\n"
-            f"      <false/>\n"
-            f"    <key>LaunchOnlyOnce</key>\n"
-            f"      <true/>\n"
-            f"  </dict>\n"
-            f"</plist>"
-        )
+        # grep exits non-zero when the label isn't listed
+        return bool(_status) and _status.returncode == 0
 
-        logger.debug(f"Creating plist file {self._service_path}")
-        with open(self._service_path, "w") as f:
-            f.write(_plist)
+    def _render(self) -> str:
+        """ Return the contents of the plist file """
+        import plistlib
+
+        _plist = {
+            "EnvironmentVariables": self._environment,
+            "Label": self._service_name,
+            "Program": self._executable_path,
+            "ProgramArguments": self._program_arguments,
+            "RunAtLoad": self._run_at_load,
+            "KeepAlive": self._keep_alive,
+            "LaunchOnlyOnce": self._launch_only_once,
+        }
+        return plistlib.dumps(_plist, sort_keys=False).decode()
+
+    def _write_if_changed(self) -> bool:
+        """ Atomically write the plist file if its contents changed. Returns True if it was written """
+        return _write_if_changed(self._service_path, self._render(), 0o644)
 
     def disable(self):
         """ Disable the service without changing its current state """
         if self._is_active():
-            _disable = "launchctl load -w " + self._service_path
+            _disable = "launchctl load -w " + str(self._service_path)
             subprocessor.run_subprocess([_disable])
             logging.info(
                 f"Automatic start disabled, {self._service_name} is still running.")
         else:
-            _disable = "launchctl unload -w " + self._service_path
+            _disable = "launchctl unload -w " + str(self._service_path)
             subprocessor.run_subprocess([_disable])
             logging.info(
                 f"Automatic start disabled, {self._service_name} is not running.")
 
     def remove(self):
         if self._service_path.is_file():
-            _unload = "launchctl unload " + self._service_path
-            _remove = "launchctl remove" + self._service_name
-            subprocessor.run_subprocess([_unload, _remove])
+            _unload = "launchctl unload " + str(self._service_path)
+            _remove = "launchctl remove " + self._service_name
+            subprocessor.run_batch([_unload, _remove])
             self._service_path.unlink(missing_ok=True)
             logger.info(f"{self._service_name} removed.")
             return True
 
     def create(self):
-        """ Create a LaunchD service"""
-        _load = "launchctl load " + self._service_path
+        """ Create or update a LaunchD service. It is only reloaded if the plist changed """
+        _load = "launchctl load " + str(self._service_path)
+        _unload = "launchctl unload " + str(self._service_path)
         _start = "launchctl start " + self._service_name
-        # Delete the service if it exists
-        if self._service_path.is_file():
-            self.remove()
-        self._make_plist_file()
-        subprocessor.run_subprocess([_load, _start])
+        try:
+            _changed = self._write_if_changed()
+        except OSError as err:
+            logger.error(f"Error creating plist file; {self._service_path} ERROR: {str(err)}")
+            return False
+        _active = self._is_active()
+        if not _changed and _active:
+            logger.info("%s is unchanged and running.", self._service_name)
+            return True
+        if _changed and _active:
+            subprocessor.run_batch([_unload, _load, _start])
+        else:
+            subprocessor.run_batch([_load, _start])
         # Check to make sure it's running
         if self._is_active():
             logger.info("Automatic start enabled, %s is running.", self._service_name)
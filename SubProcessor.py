@@ -1,14 +1,149 @@
 import logging
+import os
+import select
+import shlex
+import signal
 import subprocess
+import time
+import uuid
 from Utils import Utils
 logger = logging.getLogger(__name__)
 
 utils = Utils
 
 
+class CommandResult(object):
+    """The outcome of a single command run by `SubProcessor.run_many`."""
+
+    def __init__(self, command, returncode=None, stdout=None, stderr=None,
+                 started=None, duration=None, timed_out=False, error=None):
+        self.command = command
+        self.returncode = returncode
+        self.stdout = stdout if stdout is not None else []
+        self.stderr = stderr if stderr is not None else []
+        self.started = started
+        self.duration = duration
+        self.timed_out = timed_out
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out and self.error is None
+
+    def __repr__(self):
+        return (f"CommandResult(command={self.command!r}, returncode={self.returncode}, "
+                f"duration={self.duration}, timed_out={self.timed_out})")
+
+
+class ShellSession(object):
+    """A long-lived shell that runs commands one after another without a fork/exec of /bin/sh each time.
+
+    Commands share the shell's state, so `cd` and `export` carry over to later commands.
+    stderr is merged into stdout and each command's output is returned on its own CommandResult.
+    """
+
+    def __init__(self, shell="/bin/sh", env=None):
+        self._shell = shell
+        self._env = env
+        self._process = None
+        self._buffer = b""
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        if self._process and self._process.poll() is None:
+            return
+        logger.debug(f"Starting shell session {self._shell}.")
+        self._buffer = b""
+        self._process = subprocess.Popen(
+            [self._shell],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=self._env,
+            start_new_session=os.name == "posix",
+        )
+
+    def close(self):
+        if not self._process:
+            return
+        if self._process.poll() is None:
+            try:
+                self._process.stdin.write(b"exit\n")
+                self._process.stdin.close()
+                self._process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                SubProcessor._kill(self._process)
+                self._process.wait()
+        self._process.stdout.close()
+        self._process = None
+
+    def _read_until(self, marker: bytes, deadline):
+        """Read from the shell until a line ends with `marker:<exit code>`."""
+        _fd = self._process.stdout.fileno()
+        while True:
+            _index = self._buffer.find(marker)
+            if _index != -1:
+                _end = self._buffer.find(b"\n", _index)
+                if _end != -1:
+                    _output = self._buffer[:_index]
+                    _returncode = int(self._buffer[_index + len(marker) + 1:_end])
+                    self._buffer = self._buffer[_end + 1:]
+                    return _output, _returncode
+            _remaining = deadline - time.monotonic()
+            if _remaining <= 0:
+                raise subprocess.TimeoutExpired(self._shell, deadline)
+            _ready, _, _ = select.select([_fd], [], [], _remaining)
+            if not _ready:
+                continue
+            _chunk = os.read(_fd, 65536)
+            if not _chunk:
+                raise EOFError("Shell session exited.")
+            self._buffer += _chunk
+
+    def run(self, command: str, timeout=30) -> CommandResult:
+        """Run a single command in the session.
+
+        :param command: A shell command
+        :type command: str
+        :param timeout: Seconds to wait before the session is killed
+        :type timeout: int, float
+        :return: The command result
+        :rtype: CommandResult
+        """
+        self.start()
+        result = CommandResult(command)
+        _marker = f"__SUBPROCESSOR_{uuid.uuid4().hex}__"
+        _script = f"{{ {command}\n}} </dev/null\nprintf '%s:%d\\n' '{_marker}' $?\n"
+        logger.debug(f"Running {command} in shell session.")
+        result.started = time.time()
+        _start = time.perf_counter()
+        try:
+            self._process.stdin.write(_script.encode())
+            self._process.stdin.flush()
+            _output, result.returncode = self._read_until(_marker.encode(), time.monotonic() + timeout)
+            result.stdout = _output.decode(errors="replace").splitlines()
+        except subprocess.TimeoutExpired:
+            logger.error(f"{command} timed out at {timeout} seconds, restarting the shell session.")
+            result.timed_out = True
+            SubProcessor._kill(self._process)
+            self.close()
+        except (OSError, EOFError) as err:
+            logger.error(f"Shell session error running {command}: {err}")
+            result.error = err
+            self.close()
+        result.duration = time.perf_counter() - _start
+        return result
+
+
 class SubProcessor(object):
     def __init__(self):
-        pass
+        self._in_process = {"chmod": self._chmod}
 
     @staticmethod
     def run_subprocess(command: list, **kwargs):
@@ -34,3 +169,202 @@ class SubProcessor(object):
         if result.returncode == 0 or ignore_error:
             return result
         return False
+
+    @staticmethod
+    def _chmod(args: list) -> bool:
+        """In-process `chmod MODE PATH...`. Returns False if the arguments need the real chmod."""
+        if len(args) < 2 or args[0].startswith("-"):
+            return False
+        # Relative paths are resolved against the shell session's cwd, not ours
+        if not all(os.path.isabs(_path) for _path in args[1:]):
+            return False
+        try:
+            _mode = int(args[0], 8)
+        except ValueError:
+            return False
+        for _path in args[1:]:
+            os.chmod(_path, _mode)
+        return True
+
+    def _run_in_process(self, command: str):
+        """Run trivial commands without spawning anything. Returns None if the command isn't handled."""
+        try:
+            _argv = shlex.split(command)
+        except ValueError:
+            return None
+        if not _argv or _argv[0] not in self._in_process:
+            return None
+        # Anything with shell syntax in it goes to the shell
+        if any(_c in command for _c in "|&;<>$`*?~[{\n\r"):
+            return None
+        result = CommandResult(command, started=time.time())
+        _start = time.perf_counter()
+        try:
+            if not self._in_process[_argv[0]](_argv[1:]):
+                return None
+            result.returncode = 0
+        except OSError as err:
+            logger.error(f"{command} failed: {err}")
+            result.returncode = 1
+            result.stderr = [str(err)]
+        result.duration = time.perf_counter() - _start
+        return result
+
+    def run_batch(self, commands: list, **kwargs) -> list:
+        """Run a sequence of shell commands in one long-lived shell.
+
+        Trivial commands such as `chmod` are done in-process.
+
+        :param commands: Shell command strings, run in order
+        :type commands: list
+        :param kwargs: timeout (seconds, per command), env (dict), stop_on_error (bool), session (ShellSession)
+        :return: One CommandResult per command that was run
+        :rtype: list
+        """
+        timeout = kwargs.get("timeout", 30)
+        stop_on_error = kwargs.get("stop_on_error", False)
+        session = kwargs.get("session")
+        _own_session = session is None
+        if _own_session:
+            session = ShellSession(env=kwargs.get("env"))
+        results = []
+        try:
+            for _command in commands:
+                _result = self._run_in_process(_command) or session.run(_command, timeout=timeout)
+                results.append(_result)
+                if stop_on_error and not _result.ok:
+                    logger.warning(f"{_command} failed, not running the rest of the batch.")
+                    break
+        finally:
+            if _own_session:
+                session.close()
+        return results
+
+    def run_many(self, commands: list, **kwargs) -> list:
+        """Run many commands concurrently and return a result for each, in order.
+
+        :param commands: argv lists, or strings when `shell` is True
+        :type commands: list
+        :param kwargs: See `run_many_async`
+        :return: One CommandResult per command
+        :rtype: list
+        """
+        import asyncio
+
+        return asyncio.run(self.run_many_async(commands, **kwargs))
+
+    async def run_many_async(self, commands: list, **kwargs) -> list:
+        """Run many commands concurrently with a bounded number of workers.
+
+        Output is read line-by-line. If a callback is given for a stream its lines are passed
+        to it as `callback(command, line)` and not kept, otherwise they are collected on the result.
+
+        :param commands: argv lists, or strings when `shell` is True
+        :type commands: list
+        :param kwargs: max_workers (int), timeout (seconds, per command), env (dict),
+            shell (bool), on_stdout (callable), on_stderr (callable)
+        :return: One CommandResult per command
+        :rtype: list
+        """
+        import asyncio
+
+        max_workers = kwargs.get("max_workers", os.cpu_count() or 4)
+        _semaphore = asyncio.Semaphore(max_workers)
+
+        async def _bounded(_command):
+            async with _semaphore:
+                return await self._run_one(_command, **kwargs)
+
+        return await asyncio.gather(*[_bounded(_c) for _c in commands])
+
+    @staticmethod
+    async def _read_stream(stream, command, callback, lines):
+        # Read in chunks and split lines here, readline() fails on lines over the StreamReader limit
+        _buffer = b""
+        while True:
+            _chunk = await stream.read(65536)
+            if _chunk:
+                _buffer += _chunk
+                *_lines, _buffer = _buffer.split(b"\n")
+            else:
+                _lines = [_buffer] if _buffer else []
+            for _line in _lines:
+                _line = _line.decode(errors="replace")
+                if callback:
+                    callback(command, _line)
+                else:
+                    lines.append(_line)
+            if not _chunk:
+                break
+
+    @staticmethod
+    def _kill(process):
+        """Kill the process and everything in its process group."""
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+    async def _run_one(self, command, **kwargs) -> CommandResult:
+        import asyncio
+
+        env = kwargs.get("env")
+        timeout = kwargs.get("timeout", 30)
+        shell = kwargs.get("shell", False)
+        on_stdout = kwargs.get("on_stdout")
+        on_stderr = kwargs.get("on_stderr")
+        result = CommandResult(command)
+        logger.debug(f'Running {command}.')
+        _options = {
+            "stdout": asyncio.subprocess.PIPE,
+            "stderr": asyncio.subprocess.PIPE,
+            "env": env,
+        }
+        # A new session makes the command a process group leader so a timeout kills its children too
+        if os.name == "posix":
+            _options["start_new_session"] = True
+        result.started = time.time()
+        _start = time.perf_counter()
+        try:
+            if shell:
+                process = await asyncio.create_subprocess_shell(command, **_options)
+            else:
+                process = await asyncio.create_subprocess_exec(*command, **_options)
+        except OSError as err:
+            logger.error(f"Unable to run {command}: {err}")
+            result.error = err
+            result.duration = time.perf_counter() - _start
+            return result
+
+        _tasks = [
+            asyncio.ensure_future(self._read_stream(process.stdout, command, on_stdout, result.stdout)),
+            asyncio.ensure_future(self._read_stream(process.stderr, command, on_stderr, result.stderr)),
+            asyncio.ensure_future(process.wait()),
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*_tasks), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{command} timed out at {timeout} seconds.")
+            result.timed_out = True
+        except Exception as err:
+            # A failing output callback or reader ends the command
+            logger.error(f"Error reading output of {command}: {err}")
+            result.error = err
+        finally:
+            # The leader may have exited while its children still hold the pipes, kill the whole group
+            if result.timed_out or process.returncode is None or not all(_t.done() for _t in _tasks):
+                self._kill(process)
+            for _task in _tasks:
+                _task.cancel()
+            await asyncio.gather(*_tasks, return_exceptions=True)
+            await process.wait()
+            # Close the pipes now, not when the transport is collected after the loop is gone
+            _transport = getattr(process, "_transport", None)
+            if _transport:
+                _transport.close()
+        result.returncode = process.returncode
+        result.duration = time.perf_counter() - _start
+        return result
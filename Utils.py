@@ -5,13 +5,18 @@ import os
 import sys
 from pathlib import Path
 from typing import Union
-from logging import handlers
 
-from DateTimeFormatter import DateTimeFormatter
+logger = logging.getLogger(__name__)
 
-dtf = DateTimeFormatter()
 
-logger = logging.getLogger(__name__)
+def __getattr__(name):
+    # DateTimeFormatter is only needed for logging setup, build it on first use
+    if name == "dtf":
+        from DateTimeFormatter import DateTimeFormatter
+
+        globals()["dtf"] = DateTimeFormatter()
+        return globals()["dtf"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Utils:
@@ -33,6 +38,9 @@ class Utils:
         :type console_loglevel: int, str
         """
 
+        from logging import handlers
+
+        dtf = globals().get("dtf") or __getattr__("dtf")
         logger = logging.getLogger()
         logger.setLevel(loglevel)
 
@@ -45,7 +53,7 @@ class Utils:
         rollover_required = log_path.exists()
         # file_formatter = logging.Formatter("{asctime}: {message}", style="{")
         file_formatter = logging.Formatter("{dtf.r3339}: {message}", style="{")
-        file = logging.handlers.RotatingFileHandler(filename=log_path, backupCount=log_retention)
+        file = handlers.RotatingFileHandler(filename=log_path, backupCount=log_retention)
         file.setFormatter(file_formatter)
         logger.addHandler(file)
         if rollover_required:
@@ -0,0 +1,76 @@
+"""Import time of each module, measured with `python -X importtime` in a fresh interpreter.
+
+With --check, exits non-zero if importing a module pulls in a dependency that should only load on use,
+or if --budget-ms is given and a module's cumulative import time exceeds it.
+Run from the repository root: python benchmarks/bench_import_time.py [--check] [--budget-ms MS]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+_root = Path(__file__).parent.parent.resolve()
+
+# Dependencies that must not be imported just by importing the module
+LAZY = {
+    "Utils": ["logging.handlers", "DateTimeFormatter", "iso8601", "rfc3339", "dateutil"],
+    "DateTimeFormatter": ["iso8601", "rfc3339", "dateutil"],
+    "SubProcessor": ["asyncio", "DateTimeFormatter", "iso8601", "rfc3339", "dateutil"],
+    "INIConfiguration": ["configparser", "concurrent.futures", "DateTimeFormatter", "iso8601", "dateutil"],
+    "ServiceCreator": ["asyncio", "plistlib", "DateTimeFormatter", "iso8601", "rfc3339", "dateutil"],
+    "SecretsKeyring": ["keyring", "concurrent.futures"],
+    "PathDetails": [],
+}
+
+
+def import_time(module):
+    """Return (cumulative microseconds, set of imported module names) for a fresh `import module`."""
+    _result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=_root, capture_output=True, text=True,
+    )
+    if _result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{_result.stderr}")
+    _cumulative = 0
+    _imported = set()
+    for _line in _result.stderr.splitlines():
+        if not _line.startswith("import time:") or "cumulative" in _line:
+            continue
+        _, _total, _name = _line[len("import time:"):].split("|")
+        _name = _name.strip()
+        _imported.add(_name)
+        if _name == module:
+            _cumulative = int(_total)
+    return _cumulative, _imported
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    _parser.add_argument("--check", action="store_true")
+    _parser.add_argument("--budget-ms", type=float)
+    _parser.add_argument("--runs", type=int, default=5)
+    _args = _parser.parse_args()
+
+    _failures = []
+    for (_module, _lazy) in LAZY.items():
+        _times = []
+        _imported = set()
+        for _ in range(_args.runs):
+            _us, _imported = import_time(_module)
+            _times.append(_us)
+        _ms = statistics.median(_times) / 1000
+        _eager = sorted(_m for _m in _lazy if _m in _imported)
+        print(f"{_module:20} {_ms:8.2f} ms" + (f"  eager: {', '.join(_eager)}" if _eager else ""))
+        if _eager:
+            _failures.append(f"{_module} imports {', '.join(_eager)}")
+        if _args.budget_ms and _ms > _args.budget_ms:
+            _failures.append(f"{_module} took {_ms:.2f} ms, budget is {_args.budget_ms} ms")
+
+    if _args.check and _failures:
+        print("\n".join(_failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
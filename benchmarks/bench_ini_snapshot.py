@@ -0,0 +1,56 @@
+"""Startup time of INIConfiguration.get with and without a compiled snapshot.
+
+Each measurement is a fresh interpreter that imports INIConfiguration and loads a large generated INI file.
+Run from the repository root: python benchmarks/bench_ini_snapshot.py [sections] [keys] [runs]
+"""
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_root = Path(__file__).parent.parent.resolve()
+
+_script = (
+    "import sys; sys.path.insert(0, {root!r})\n"
+    "from INIConfiguration import INIConfiguration\n"
+    "INIConfiguration({config!r}, normalize=True, snapshot_path={snapshot!r}).get()\n"
+)
+
+
+def _write_config(path, sections, keys):
+    with open(path, "w") as f:
+        for _s in range(sections):
+            f.write(f"[Section {_s}]\n")
+            for _k in range(keys):
+                f.write(f"Key {_k} = {'yes' if _k % 3 == 0 else f'value {_s}.{_k}'}\n")
+            f.write("\n")
+
+
+def _startup(config, snapshot, runs):
+    _code = _script.format(root=str(_root), config=str(config), snapshot=snapshot and str(snapshot))
+    _times = []
+    for _ in range(runs):
+        _start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", _code], check=True)
+        _times.append(time.perf_counter() - _start)
+    return statistics.median(_times)
+
+
+def main(sections=500, keys=40, runs=10):
+    with tempfile.TemporaryDirectory() as _d:
+        _config = Path(_d).joinpath("config.ini")
+        _snapshot = Path(_d).joinpath("config.snapshot")
+        _write_config(_config, sections, keys)
+        _plain = _startup(_config, None, runs)
+        # The first run compiles the snapshot
+        _startup(_config, _snapshot, 1)
+        _snap = _startup(_config, _snapshot, runs)
+    print(f"{sections} sections x {keys} keys, median of {runs} runs")
+    print(f"INIConfiguration.get:           {_plain * 1000:8.1f} ms")
+    print(f"INIConfiguration.get, snapshot: {_snap * 1000:8.1f} ms ({_plain / _snap:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*[int(_a) for _a in sys.argv[1:4]])
@@ -0,0 +1,36 @@
+"""Commands/second for SubProcessor.run_subprocess versus SubProcessor.run_batch.
+
+Run from the repository root: python benchmarks/bench_subprocessor.py [count]
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+
+from SubProcessor import SubProcessor  # noqa: E402
+
+subprocessor = SubProcessor()
+
+
+def _rate(count, func):
+    _start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - _start)
+
+
+def main(count=200):
+    with tempfile.NamedTemporaryFile() as _f:
+        _commands = []
+        for _i in range(count):
+            _commands.append("true" if _i % 2 else f"chmod 644 {_f.name}")
+
+        _one_shot = _rate(count, lambda: [subprocessor.run_subprocess([_c]) for _c in _commands])
+        _batched = _rate(count, lambda: subprocessor.run_batch(_commands))
+    print(f"run_subprocess: {_one_shot:10.1f} commands/s")
+    print(f"run_batch:      {_batched:10.1f} commands/s ({_batched / _one_shot:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,285 @@
+"""Benchmarks for the package's hot paths, with stored baselines and optional profiling.
+
+Run from the repository root:
+    python benchmarks/run.py                    # run everything, compare against benchmarks/baselines.json
+    python benchmarks/run.py utils ini          # only benchmarks whose name contains "utils" or "ini"
+    python benchmarks/run.py --save             # store the results as the new baselines
+    python benchmarks/run.py --profile          # dump the cProfile hot spots for each benchmark
+    python benchmarks/run.py --tracemalloc      # report the allocation peak and top allocation sites
+
+Exits non-zero if a benchmark is more than --threshold slower than its baseline.
+Benchmarks whose dependencies aren't installed are skipped.
+"""
+import argparse
+import cProfile
+import http.server
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+_root = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(_root))
+
+BASELINES = Path(__file__).parent.joinpath("baselines.json")
+
+# name -> setup function returning (callable to time, cleanup callable or None)
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def _register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return _register
+
+
+class _QuietHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        _body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@benchmark("dohttp.request")
+def _dohttp_request():
+    from DoHttp import DoHTTP
+
+    _server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _QuietHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    _http = DoHTTP("GET", f"http://127.0.0.1:{_server.server_address[1]}/")
+
+    def _cleanup():
+        _server.shutdown()
+        _server.server_close()
+    return (lambda: _http.request("/")), _cleanup
+
+
+@benchmark("datetimeformatter.format")
+def _dtf_format():
+    from DateTimeFormatter import DateTimeFormatter
+
+    _dtf = DateTimeFormatter()
+    _dtf.r3339(1600000000)
+
+    def _run():
+        _dtf.usa24(1600000000)
+        _dtf.global12(1600000000)
+        _dtf.r3339(1600000000)
+        _dtf.i8601(1600000000)
+    return _run, None
+
+
+@benchmark("datetimeformatter.parse")
+def _dtf_parse():
+    from DateTimeFormatter import DateTimeFormatter
+
+    _dtf = DateTimeFormatter()
+    _dtf.epoch("2020-09-13T12:26:40Z")
+
+    def _run():
+        _dtf.epoch("2020-09-13T12:26:40Z")
+        _dtf.usa12("2020-09-13T12:26:40+02:00")
+    return _run, None
+
+
+@benchmark("utils.diff_lists")
+def _utils_diff_lists():
+    from Utils import Utils
+
+    _a = list(range(2000))
+    _b = list(range(0, 2000, 3))
+    return (lambda: Utils.diff_lists(_a, _b)), None
+
+
+@benchmark("utils.aggregate_list_dupes")
+def _utils_aggregate_list_dupes():
+    from Utils import Utils
+
+    _lst = [_i % 97 for _i in range(10000)]
+    return (lambda: Utils.aggregate_list_dupes(_lst)), None
+
+
+@benchmark("utils.merge_dicts")
+def _utils_merge_dicts():
+    from Utils import Utils
+
+    _utils = Utils()
+    _b = {f"s{_s}": {f"k{_k}": _k for _k in range(20)} for _s in range(50)}
+
+    def _run():
+        _a = {f"s{_s}": {f"k{_k}": -_k for _k in range(0, 20, 2)} for _s in range(0, 50, 2)}
+        _utils.merge_dicts(_a, _b)
+    return _run, None
+
+
+@benchmark("utils.enumerate_sub_dirs")
+def _utils_enumerate_sub_dirs():
+    from Utils import Utils
+
+    _utils = Utils()
+    _tmp = tempfile.TemporaryDirectory()
+    for _i in range(10):
+        for _j in range(10):
+            Path(_tmp.name).joinpath(f"d{_i}", f"d{_j}").mkdir(parents=True)
+    return (lambda: _utils.enumerate_sub_dirs(_tmp.name)), _tmp.cleanup
+
+
+@benchmark("pathdetails")
+def _pathdetails():
+    from PathDetails import PathDetails
+
+    _tmp = tempfile.TemporaryDirectory()
+    _file = Path(_tmp.name).joinpath("some.file.txt")
+    _file.write_text("x")
+
+    def _run():
+        PathDetails(_file)
+        PathDetails(_tmp.name)
+    return _run, _tmp.cleanup
+
+
+@benchmark("iniconfiguration.get")
+def _iniconfiguration_get():
+    from INIConfiguration import INIConfiguration
+
+    _tmp = tempfile.TemporaryDirectory()
+    _path = Path(_tmp.name).joinpath("config.ini")
+    with open(_path, "w") as f:
+        for _s in range(50):
+            f.write(f"[Section {_s}]\n")
+            for _k in range(20):
+                f.write(f"Key {_k} = {'yes' if _k % 3 == 0 else f'value {_k}'}\n")
+    _config = INIConfiguration(_path, normalize=True)
+    return _config.get, _tmp.cleanup
+
+
+@benchmark("subprocessor.run_subprocess")
+def _subprocessor_run_subprocess():
+    from SubProcessor import SubProcessor
+
+    return (lambda: SubProcessor.run_subprocess(["true"])), None
+
+
+def _time(func, min_time=0.2, repeats=5):
+    """Return the best seconds per call over `repeats` rounds of at least `min_time` seconds each."""
+    _number = 1
+    while True:
+        _start = time.perf_counter()
+        for _ in range(_number):
+            func()
+        _elapsed = time.perf_counter() - _start
+        if _elapsed >= min_time / 10:
+            break
+        _number *= 10
+    _number = max(1, int(_number * min_time / max(_elapsed, 1e-9)))
+    _best = None
+    for _ in range(repeats):
+        _start = time.perf_counter()
+        for _ in range(_number):
+            func()
+        _per_call = (time.perf_counter() - _start) / _number
+        _best = _per_call if _best is None else min(_best, _per_call)
+    return _best
+
+
+def _profile(func, top):
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    for _ in range(100):
+        func()
+    _profiler.disable()
+    _out = io.StringIO()
+    pstats.Stats(_profiler, stream=_out).sort_stats("cumulative").print_stats(top)
+    return _out.getvalue()
+
+
+def _allocations(func, top):
+    tracemalloc.start()
+    # Keep the result alive so the snapshot shows where it was allocated
+    _result = func()
+    _snapshot = tracemalloc.take_snapshot()
+    _, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del _result
+    _lines = [f"    peak: {_peak / 1024:.1f} KiB"]
+    for _stat in _snapshot.statistics("lineno")[:top]:
+        _lines.append(f"    {_stat}")
+    return "\n".join(_lines)
+
+
+def _format_time(seconds):
+    for (_unit, _scale) in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= _scale:
+            return f"{seconds / _scale:8.2f} {_unit}"
+    return f"{seconds / 1e-9:8.2f} ns"
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    _parser.add_argument("names", nargs="*", help="Only run benchmarks whose name contains one of these")
+    _parser.add_argument("--save", action="store_true", help="Store the results as the new baselines")
+    _parser.add_argument("--threshold", type=float, default=0.25,
+                         help="Allowed slowdown against the baseline as a fraction (default 0.25)")
+    _parser.add_argument("--profile", action="store_true", help="Print cProfile hot spots")
+    _parser.add_argument("--tracemalloc", action="store_true", help="Print allocation peak and top sites")
+    _parser.add_argument("--top", type=int, default=10, help="Rows to show when profiling")
+    _args = _parser.parse_args()
+
+    # The code under test logs at debug level, keep it quiet
+    logging.disable(logging.CRITICAL)
+    _baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    _results = {}
+    _regressions = []
+    for (_name, _setup) in BENCHMARKS.items():
+        if _args.names and not any(_n in _name for _n in _args.names):
+            continue
+        try:
+            _func, _cleanup = _setup()
+            _func()
+        except Exception as err:
+            print(f"{_name:32} skipped: {type(err).__name__}: {err}")
+            continue
+        try:
+            _seconds = _time(_func)
+            _results[_name] = _seconds
+            _line = f"{_name:32} {_format_time(_seconds)}"
+            if _name in _baselines:
+                _change = _seconds / _baselines[_name] - 1
+                _line += f"  {_change:+7.1%} vs baseline"
+                if _change > _args.threshold:
+                    _line += "  REGRESSION"
+                    _regressions.append(_name)
+            print(_line)
+            if _args.profile:
+                print(_profile(_func, _args.top))
+            if _args.tracemalloc:
+                print(_allocations(_func, _args.top))
+        finally:
+            if _cleanup:
+                _cleanup()
+
+    if _args.save:
+        _baselines.update(_results)
+        BASELINES.write_text(json.dumps(_baselines, indent=2, sort_keys=True) + os.linesep)
+        print(f"Saved {len(_results)} baselines to {BASELINES}")
+    elif _regressions:
+        print(f"{len(_regressions)} regression(s) over {_args.threshold:.0%}: {', '.join(_regressions)}",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()